@@ -6,3 +6,4 @@ ments or specific questions, please contact me at josh.kalina@refinitiv.com
 """
 
 from datascope.session import *
+from datascope.async_session import async_session
@@ -0,0 +1,141 @@
+"""
+asyncio counterpart of datascope.session. The http calls run on a bounded thread pool sharing the pooled connections of the underlying session, while every wait between polls is an awaitable sleep, so hundreds of extractions can be gathered on one event loop.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import requests
+from datascope.session import session, _template_methods, _extraction
+
+
+class async_session:
+    """
+    Create it with dss = await async_session.create('id','pw'), it accepts the same keyword arguments as session. The template methods take the same arguments as on session, are awaited, as the field check may read the field catalog from the server, and return the requestBody they built, so extractions can be prepared first and gathered afterwards:
+
+        bodies = [await dss.price('eod', fields), await dss.composite(fields)]
+        results = await asyncio.gather(*[dss.extract(i) for i in bodies])
+
+    max_concurrency bounds the number of http calls in flight at any time, whatever the number of extractions awaited.
+    The synchronous session is available as dss.session, e.g. for dss.session.content after load or extract calls.
+    """
+
+    def __init__(self, sync_session, max_concurrency = 16):
+        self.session = sync_session
+        self._pool = ThreadPoolExecutor(max_workers = max_concurrency)
+        self._limit = asyncio.Semaphore(max_concurrency)
+        self._build_lock = threading.Lock()
+
+    @classmethod
+    async def create(cls, name, pw, max_concurrency = 16, **kwargs):
+        """
+        Authenticates without blocking the event loop and returns the async_session. kwargs are passed to session, e.g. pool_size, which should be at least max_concurrency.
+        """
+        kwargs.setdefault("pool_size", max_concurrency)
+        _sync = await asyncio.get_running_loop().run_in_executor(None, partial(session, name, pw, **kwargs))
+        return cls(_sync, max_concurrency)
+
+    async def _call(self, fn, *args, **kwargs):
+        """
+        Runs a blocking call of the underlying session on the thread pool, within the concurrency limit.
+        """
+        async with self._limit:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, partial(fn, *args, **kwargs))
+
+    async def authenticate(self, force = False):
+        return await self._call(self.session.authenticate, force)
+
+    async def preferences(self):
+        return await self._call(self.session.preferences)
+
+    async def rights(self):
+        return await self._call(self.session.rights)
+
+    async def get_bond_sched_types(self):
+        return await self._call(self.session.get_bond_sched_types)
+
+    async def get_fields(self, template):
+        return await self._call(self.session.get_fields, template)
+
+    async def load_pd(self, dataframe, **kwargs):
+        """
+        session.load_pd without blocking the event loop. The instruments are kept on the underlying session.
+        """
+        return await self._call(self.session.load_pd, dataframe, **kwargs)
+
+    async def load_csv(self, filename, **kwargs):
+        """
+        session.load_csv without blocking the event loop. The instruments are kept on the underlying session.
+        """
+        return await self._call(self.session.load_csv, filename, **kwargs)
+
+    async def extract(self, body = None):
+        """
+        Submits one extraction and polls it with awaitable sleeps following the session poll_options. Returns the result dictionary of session.extract_many (status_code, content, notes, ricmaintenance, error, metrics).
+        body: the requestBody to extract, as returned by the template methods. Defaults to the last one built.
+        """
+        if body is None:
+            body = getattr(self.session, 'requestBody', None)
+        if body is None:
+            print('Error: missing report template. You need to add reports with one of the datascope.pricing/corax/reference methods')
+            return {"status_code": None, "content": None, "notes": None, "ricmaintenance": None, "error": "missing report template", "metrics": None}
+
+        try:
+            _types = await self._call(self.session._content_types, body)
+            _job = await self._call(_extraction, self.session, body, self.session.base_url + '/Extractions/ExtractWithNotes', None, _types)
+        except requests.RequestException as e:
+            return {"status_code": None, "content": None, "notes": None, "ricmaintenance": None, "error": e, "metrics": None}
+        while True:
+            try:
+                _resp, _result = await self._call(self.session._send, *_job.call(), _job.types)
+                _delay = await self._call(_job.answer, _resp, _result)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                _delay = _job.fail(e)
+            if _delay is None:
+                break
+            await asyncio.sleep(_delay)
+        return await self._call(_job.close)
+
+    async def extract_many(self, extractions):
+        """
+        Async generator yielding (key, result) tuples in the order the jobs complete, like session.extract_many.
+        extractions: dictionary of {key: requestBody}, or a list of requestBody in which case the list position is the key.
+        """
+        if not isinstance(extractions, dict):
+            extractions = dict(enumerate(extractions))
+
+        async def _keyed(k, body):
+            return k, await self.extract(body)
+
+        for f in asyncio.as_completed([_keyed(k, v) for k, v in extractions.items()]):
+            yield await f
+
+    def close(self):
+        self.session.close()
+        self._pool.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+def _template(name):
+    def _build(self, *args, **kwargs):
+        with self._build_lock:
+            _previous = getattr(self.session, 'requestBody', None)
+            getattr(self.session, name)(*args, **kwargs)
+            _body = getattr(self.session, 'requestBody', None)
+            return None if _body is _previous else _body
+
+    async def build(self, *args, **kwargs):
+        return await self._call(_build, self, *args, **kwargs)
+    build.__name__ = name
+    build.__doc__ = getattr(session, name).__doc__
+    return build
+
+
+for _name in _template_methods:
+    setattr(async_session, _name, _template(_name))
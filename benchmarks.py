@@ -0,0 +1,197 @@
+"""
+Micro-benchmarks of the CPU bound paths of session: building the instrument payload in load_pd and load_csv, building the request bodies of the template methods, and decoding extraction responses into DataFrames. Inputs are synthetic universes and responses of the sizes asked for, the session runs against datascope.mock_server so no credentials are needed.
+
+    python -m datascope.benchmarks --sizes 1000 100000 1000000 --save
+    python -m datascope.benchmarks --sizes 1000 100000 1000000 --compare
+
+--save stores the timings as the baseline file, --compare checks a new run against it and exits with 1 when a benchmark is slower than the baseline by more than the tolerance.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+from datascope.session import session
+from datascope import stream
+from datascope import mock_server
+
+default_sizes = [1000, 100000, 1000000]
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+fields = ["Trade Date", "Bid Price", "Ask Price", "Currency Code", "Exchange Code"]
+
+
+def universe(size, seed = 0):
+    """
+    DataFrame of size identifiers with traditional DSS type codes (RIC, ISN, CSP, SED), so the type corrections are exercised.
+    """
+    _random = np.random.default_rng(seed)
+    _types = _random.choice(np.array(["RIC", "ISN", "CSP", "SED"]), size)
+    _ids = pd.Series(np.arange(size)).map("ID{:09d}".format)
+    return pd.DataFrame({"type": _types, "id": _ids})
+
+
+def response(size, seed = 0):
+    """
+    ExtractWithNotes response body (bytes) of size rows for the benchmark fields.
+    """
+    _random = np.random.default_rng(seed)
+    _bid = _random.uniform(10, 200, size).round(4)
+    _rows = [{
+        "IdentifierType": "Ric",
+        "Identifier": "ID{:09d}".format(i % 5000),
+        "Trade Date": "2020-01-%02dT00:00:00.000Z" % (i % 28 + 1),
+        "Bid Price": b,
+        "Ask Price": b + 0.01,
+        "Currency Code": "USD" if i % 3 else "EUR",
+        "Exchange Code": "NYS"
+    } for i, b in enumerate(_bid.tolist())]
+    return json.dumps({"Contents": _rows, "Notes": ["notes", ""]}).encode("utf-8")
+
+
+def _best(fn, repeat):
+    """
+    Best wall time of repeat calls of fn, in seconds. Output printed by the session is discarded.
+    """
+    _times = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            _start = time.perf_counter()
+            fn()
+            _times.append(time.perf_counter() - _start)
+    return min(_times)
+
+
+def request_bodies(dss):
+    """
+    Builds the request body of the main template methods and serializes it the way extract posts it. Building alone only references the loaded identifiers, the cost growing with the universe is in the serialization.
+    """
+    _builders = [
+        lambda: dss.composite(["Asset Type", "Currency Code"]),
+        lambda: dss.price("eod", fields),
+        lambda: dss.price_history(fields, "2020-01-01", "2020-12-31"),
+        lambda: dss.historical_reference("2020-01-01", "2020-12-31", ["Currency Code"]),
+        lambda: dss.corax_dividend("2020-01-01", "2020-12-31", ["Ex-Date", "Dividend Rate"]),
+        lambda: dss.corax_cap_change("2020-01-01", "2020-12-31", ["Ex-Date"]),
+    ]
+    for build in _builders:
+        build()
+        json.dumps(dss.requestBody)
+
+
+def run(sizes = default_sizes, repeat = 5):
+    """
+    Runs every benchmark at every size and returns {'name|size': best seconds}.
+    """
+    _results = {}
+    with mock_server.mock_server(job_duration=0) as server, tempfile.TemporaryDirectory() as _folder:
+        with contextlib.redirect_stdout(io.StringIO()):
+            dss = session("bench", "mark", base_url=server.url, token_cache=False, check_fields=False, cache_dir=_folder)
+        _types = mock_server.fields
+
+        for size in sizes:
+            _universe = universe(size)
+            _csv = os.path.join(_folder, "universe_" + str(size) + ".csv")
+            _universe.to_csv(_csv, header=False, index=False)
+            _body = response(size)
+            _rows = json.loads(_body)["Contents"]
+
+            _cases = {
+                "load_pd": lambda: dss.load_pd(_universe, validate=False),
+                "load_csv": lambda: dss.load_csv(_csv, validate=False),
+            }
+            for name, fn in _cases.items():
+                _results[name + "|" + str(size)] = _best(fn, repeat)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                dss.load_pd(_universe, validate=False)
+            _cases = {
+                "request_bodies": lambda: request_bodies(dss),
+                "json_parse": lambda: json.loads(_body),
+                "frame_untyped": lambda: dss._content_frame(_rows),
+                "frame_typed": lambda: dss._content_frame(_rows, _types),
+                "decode_typed": lambda: dss._content_frame(json.loads(_body)["Contents"], _types),
+                "decode_stream": lambda: [dss._content_frame(b, _types) for b in stream.contents_batches([_body[i:i + 1048576] for i in range(0, len(_body), 1048576)], 50000, {})],
+            }
+            for name, fn in _cases.items():
+                _results[name + "|" + str(size)] = _best(fn, repeat)
+        dss.close()
+    return _results
+
+
+def environment():
+    return {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__, "machine": platform.machine(), "processor": platform.processor()}
+
+
+def save(results, path = default_baseline):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=1, sort_keys=True)
+
+
+def compare(results, path = default_baseline, tolerance = 0.5, min_seconds = 0.05):
+    """
+    Compares results with the baseline stored at path. Returns the list of (benchmark, baseline seconds, seconds) slower than the baseline by more than tolerance (0.5 = 50%). Benchmarks that took less than min_seconds in the baseline are skipped, as below some 50 ms a run varies by more than the tolerance from one run to the next.
+    The default tolerance follows the spread measured between runs of an unchanged tree on a shared host, up to 40% on the 100000 and 1000000 row cases even as the best of 5 runs. On a quiet dedicated machine a tighter --tolerance, e.g. 0.2, works.
+    """
+    with open(path) as f:
+        _baseline = json.load(f)
+    if _baseline["environment"] != environment():
+        print("Warning: the baseline was recorded on another environment", _baseline["environment"])
+    _slower = []
+    for k, v in results.items():
+        _base = _baseline["results"].get(k)
+        if _base is not None and _base >= min_seconds and v > _base * (1 + tolerance):
+            _slower.append((k, _base, v))
+    return _slower
+
+
+def report(results, baseline = None):
+    _rows = []
+    for k, v in results.items():
+        name, size = k.split("|")
+        _row = {"benchmark": name, "size": int(size), "seconds": v, "per_second": int(size) / v}
+        if baseline is not None and k in baseline:
+            _row["baseline"] = baseline[k]
+            _row["change"] = "%+.0f%%" % ((v / baseline[k] - 1) * 100)
+        _rows.append(_row)
+    print(pd.DataFrame(_rows).to_string(index=False, float_format=lambda x: "%.4f" % x))
+
+
+def main(args = None):
+    _parser = argparse.ArgumentParser(description="Micro-benchmarks of datascope.session")
+    _parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes, help="universe and response sizes, in rows")
+    _parser.add_argument("--repeat", type=int, default=5, help="runs of every benchmark, the best one is kept")
+    _parser.add_argument("--baseline", default=default_baseline, help="baseline file")
+    _parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    _parser.add_argument("--compare", action="store_true", help="compare the results with the baseline")
+    _parser.add_argument("--tolerance", type=float, default=0.5, help="slowdown allowed by --compare, 0.5 = 50%%")
+    _parser.add_argument("--min-seconds", type=float, default=0.05, help="benchmarks faster than this in the baseline are not compared")
+    _args = _parser.parse_args(args)
+
+    _results = run(_args.sizes, _args.repeat)
+
+    _baseline = None
+    if _args.compare:
+        with open(_args.baseline) as f:
+            _baseline = json.load(f)["results"]
+    report(_results, _baseline)
+
+    if _args.save:
+        save(_results, _args.baseline)
+        print("Baseline saved to", _args.baseline)
+    if _args.compare:
+        _slower = compare(_results, _args.baseline, _args.tolerance, _args.min_seconds)
+        for k, base, v in _slower:
+            print("Regression:", k, "%.4fs" % base, "->", "%.4fs" % v)
+        if _slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
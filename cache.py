@@ -0,0 +1,368 @@
+"""
+On-disk stores shared by every datascope session running on the machine. Files live in ~/.datascope unless another folder is passed in.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import shutil
+import hashlib
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+default_folder = os.path.join(os.path.expanduser("~"), ".datascope")
+
+
+@contextmanager
+def locked(path):
+    """
+    Holds an exclusive lock on path + '.lock' for the duration of the with block. The lock is taken on the file system so it is shared across processes.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_json(path, default = None):
+    """
+    Reads a json file, returning default when it is missing or unreadable.
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, obj):
+    """
+    Writes a json file through a temporary file so readers never see half a file. The file is only readable by the current user.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _tmp = path + "." + str(os.getpid()) + ".tmp"
+    with open(os.open(_tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(obj, f)
+    os.replace(_tmp, path)
+
+
+def request_key(body):
+    """
+    Canonical hash of a requestBody: the same template, fields, condition and instruments always give the same key, whatever the order of the dictionary keys.
+    """
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class token_store:
+    """
+    Tokens keyed by server (base_url) and username, shared by every process of the machine, so a token of one server, e.g. the mock_server, is never sent to another. DSS tokens are valid for 24 hours from the time they are issued.
+    """
+
+    lifetime = 24 * 60 * 60
+
+    def __init__(self, folder = None):
+        self.path = os.path.join(folder or default_folder, "tokens.json")
+
+    def lock(self):
+        """
+        Lock to hold while checking for a token and requesting a new one, so concurrent processes only authenticate once.
+        """
+        return locked(self.path)
+
+    def _key(self, base_url, username):
+        return base_url + "|" + username
+
+    def get(self, base_url, username, min_life = 0):
+        """
+        Returns (token, expiry as epoch seconds) of the stored token for username on base_url, or None when there is none with at least min_life seconds left.
+        """
+        _entry = read_json(self.path, {}).get(self._key(base_url, username))
+        if _entry is None or _entry["expires"] - time.time() <= min_life:
+            return None
+        return _entry["token"], _entry["expires"]
+
+    def put(self, base_url, username, token, issued = None):
+        """
+        Stores a token for username on base_url and returns its expiry as epoch seconds. Call while holding lock().
+        """
+        _expires = (issued or time.time()) + self.lifetime
+        _tokens = read_json(self.path, {})
+        _tokens[self._key(base_url, username)] = {"token": token, "expires": _expires}
+        write_json(self.path, _tokens)
+        return _expires
+
+
+class catalog:
+    """
+    Reference answers from DSS that rarely change, such as the valid field names of each template, kept as one json file per server (base_url) and key for ttl seconds.
+    """
+
+    def __init__(self, folder = None, ttl = 7 * 24 * 60 * 60):
+        self.folder = os.path.join(folder or default_folder, "catalog")
+        self.ttl = ttl
+
+    def _path(self, base_url, key):
+        return os.path.join(self.folder, key + "_" + hashlib.sha1(base_url.encode("utf-8")).hexdigest()[:16] + ".json")
+
+    def get(self, base_url, key):
+        """
+        Returns the stored value of key for base_url, or None when it is missing or older than ttl.
+        """
+        _entry = read_json(self._path(base_url, key))
+        if _entry is None or time.time() - _entry["stamp"] > self.ttl:
+            return None
+        return _entry["value"]
+
+    def put(self, base_url, key, value):
+        write_json(self._path(base_url, key), {"stamp": time.time(), "value": value})
+
+
+class validation_cache:
+    """
+    Results of InstrumentListValidateIdentifiers keyed on server (base_url) and (IdentifierType, Identifier, Source), kept for ttl seconds. Backed by sqlite so several processes can share it.
+    """
+
+    batch = 500
+
+    def __init__(self, folder = None, ttl = 24 * 60 * 60):
+        self.path = os.path.join(folder or default_folder, "validation.sqlite")
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as con:
+            con.execute("DROP TABLE IF EXISTS validated")
+            con.execute("CREATE TABLE IF NOT EXISTS validations (server TEXT, type TEXT, identifier TEXT, source TEXT, row TEXT, stamp REAL, PRIMARY KEY (server, type, identifier, source))")
+
+    @contextmanager
+    def _connect(self):
+        _con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with _con:
+                yield _con
+        finally:
+            _con.close()
+
+    def _key(self, inst):
+        return (inst["IdentifierType"], inst["Identifier"], inst.get("Source") or "")
+
+    def lookup(self, base_url, inst):
+        """
+        Splits an InstrumentIdentifiers payload into (rows, missing): the cached ValidatedInstruments rows of base_url that are still fresh, and the instruments that have to be sent to the server.
+        """
+        _keys = [self._key(i) for i in inst]
+        _found = {}
+        _since = time.time() - self.ttl
+        with self._connect() as con:
+            for n in range(0, len(_keys), self.batch):
+                _part = _keys[n:n + self.batch]
+                _sql = "SELECT type, identifier, source, row FROM validations WHERE server = ? AND stamp > ? AND (type, identifier, source) IN (VALUES " + ",".join(["(?,?,?)"] * len(_part)) + ")"
+                for t, i, s, row in con.execute(_sql, [base_url, _since] + [v for k in _part for v in k]):
+                    _found[(t, i, s)] = row
+
+        _rows = []
+        _missing = []
+        for k, i in zip(_keys, inst):
+            if k in _found:
+                _rows.append(json.loads(_found[k]))
+            else:
+                _missing.append(i)
+        return _rows, _missing
+
+    def store(self, base_url, inst, rows):
+        """
+        Stores the ValidatedInstruments rows returned by base_url for an InstrumentIdentifiers payload. Rows are matched back to the instruments sent on IdentifierType and Identifier, so they are cached under the key that was asked for even when the server filled in a Source.
+        """
+        _sent = {}
+        for i in inst:
+            _sent.setdefault((i["IdentifierType"], i["Identifier"]), []).append(self._key(i))
+
+        _now = time.time()
+        _values = []
+        for row in rows:
+            for k in _sent.get((row.get("IdentifierType"), row.get("Identifier")), []):
+                _values.append((base_url,) + k + (json.dumps(row), _now))
+
+        with self._connect() as con:
+            con.executemany("INSERT OR REPLACE INTO validations VALUES (?,?,?,?,?,?)", _values)
+            con.execute("DELETE FROM validations WHERE stamp <= ?", (_now - self.ttl,))
+
+
+class result_cache:
+    """
+    Extraction results keyed on request_key of their requestBody, which session takes together with its base_url. Each entry is a folder holding the content as a gzip pickle and the notes as json. Entries expire after ttl seconds and the least recently used ones are evicted once the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, folder = None, ttl = 24 * 60 * 60, max_bytes = 2 * 1024 ** 3):
+        self.folder = os.path.join(folder or default_folder, "results")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        """
+        Returns the cached result (a dictionary with content, notes and ricmaintenance) of key, or None.
+        """
+        _path = os.path.join(self.folder, key)
+        _notes = read_json(os.path.join(_path, "notes.json"))
+        if _notes is None or time.time() - _notes["stamp"] > self.ttl:
+            return None
+        try:
+            _content = pd.read_pickle(os.path.join(_path, "content.pkl.gz"), compression="gzip")
+        except (OSError, ValueError, EOFError):
+            return None
+        os.utime(_path)
+        return {"status_code": 200, "content": _content, "notes": _notes["notes"], "ricmaintenance": _notes["ricmaintenance"], "error": None}
+
+    def put(self, key, result):
+        """
+        Stores a result under key, then evicts expired and least recently used entries.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        _tmp = os.path.join(self.folder, key + "." + str(os.getpid()) + ".tmp")
+        os.makedirs(_tmp, exist_ok=True)
+        result["content"].to_pickle(os.path.join(_tmp, "content.pkl.gz"), compression="gzip")
+        write_json(os.path.join(_tmp, "notes.json"), {"stamp": time.time(), "notes": result["notes"], "ricmaintenance": result["ricmaintenance"]})
+
+        _path = os.path.join(self.folder, key)
+        shutil.rmtree(_path, ignore_errors=True)
+        try:
+            os.replace(_tmp, _path)
+        except OSError:
+            shutil.rmtree(_tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the cache fits in max_bytes.
+        """
+        _entries = []
+        for k in os.listdir(self.folder):
+            _path = os.path.join(self.folder, k)
+            if k.endswith(".tmp") or not os.path.isdir(_path):
+                continue
+            _size = sum(os.path.getsize(os.path.join(_path, f)) for f in os.listdir(_path))
+            _entries.append((os.path.getmtime(_path), _size, _path))
+
+        _entries.sort()
+        _total = sum(i[1] for i in _entries)
+        _now = time.time()
+        for _used, _size, _path in _entries:
+            if _total <= self.max_bytes and _now - _used <= self.ttl:
+                continue
+            shutil.rmtree(_path, ignore_errors=True)
+            _total -= _size
+
+
+class instrument_lists:
+    """
+    Identifiers last synced to each server side instrument list, keyed on server (base_url), user name and list name, so only the changes have to be sent on the next sync.
+    """
+
+    def __init__(self, folder = None):
+        self.folder = os.path.join(folder or default_folder, "lists")
+
+    def _path(self, base_url, username, name):
+        return os.path.join(self.folder, hashlib.sha1((base_url + "|" + username + "|" + name).encode("utf-8")).hexdigest() + ".json")
+
+    def lock(self, base_url, username, name):
+        """
+        Lock to hold while syncing a list, so two processes never send the same changes.
+        """
+        return locked(self._path(base_url, username, name))
+
+    def get(self, base_url, username, name):
+        """
+        Returns {"list_id": ..., "identifiers": [[IdentifierType, Identifier, Source], ...]} as last stored, or None.
+        """
+        return read_json(self._path(base_url, username, name))
+
+    def put(self, base_url, username, name, list_id, identifiers):
+        write_json(self._path(base_url, username, name), {"list_id": list_id, "identifiers": sorted(list(i) for i in identifiers)})
+
+    def drop(self, base_url, username, name):
+        try:
+            os.remove(self._path(base_url, username, name))
+        except OSError:
+            pass
+
+
+class job_journal:
+    """
+    Extractions submitted to DSS, keyed on user name and request_key of their requestBody, with the location url to poll, the submission time and the status ('pending' until the result was read, then 'completed'). A process that died while polling, or another one sending the same request, reattaches to a pending job instead of submitting it again. Completed jobs are only kept as history, a new request for them is submitted again so it gets fresh data. Backed by sqlite so several processes can share it. Entries are dropped ttl seconds after submission.
+    """
+
+    def __init__(self, folder = None, ttl = 24 * 60 * 60):
+        self.path = os.path.join(folder or default_folder, "jobs.sqlite")
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS jobs (username TEXT, key TEXT, location TEXT, raw INTEGER, submitted REAL, status TEXT, updated REAL, PRIMARY KEY (username, key))")
+
+    @contextmanager
+    def _connect(self):
+        _con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with _con:
+                yield _con
+        finally:
+            _con.close()
+
+    def get(self, username, key):
+        """
+        Returns {"location", "raw", "submitted", "status"} of the pending job recorded for key, or None when there is none within ttl.
+        """
+        with self._connect() as con:
+            _row = con.execute("SELECT location, raw, submitted, status FROM jobs WHERE username = ? AND key = ? AND submitted > ? AND status = 'pending'", (username, key, time.time() - self.ttl)).fetchone()
+        if _row is None:
+            return None
+        return {"location": _row[0], "raw": bool(_row[1]), "submitted": _row[2], "status": _row[3]}
+
+    def put(self, username, key, location, raw = False):
+        """
+        Records a job just submitted, as pending, and drops the expired ones.
+        """
+        _now = time.time()
+        with self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO jobs VALUES (?,?,?,?,?,?,?)", (username, key, location, int(raw), _now, "pending", _now))
+            con.execute("DELETE FROM jobs WHERE submitted <= ?", (_now - self.ttl,))
+
+    def update(self, username, key, status):
+        with self._connect() as con:
+            con.execute("UPDATE jobs SET status = ?, updated = ? WHERE username = ? AND key = ?", (status, time.time(), username, key))
+
+    def drop(self, username, key):
+        with self._connect() as con:
+            con.execute("DELETE FROM jobs WHERE username = ? AND key = ?", (username, key))
+
+    def entries(self, username = None):
+        """
+        DataFrame of the jobs within ttl, of every user or only of username, newest first.
+        """
+        _sql = "SELECT username, key, location, raw, submitted, status, updated FROM jobs WHERE submitted > ?"
+        _args = [time.time() - self.ttl]
+        if username is not None:
+            _sql += " AND username = ?"
+            _args.append(username)
+        with self._connect() as con:
+            _rows = con.execute(_sql + " ORDER BY submitted DESC", _args).fetchall()
+        _entries = pd.DataFrame(_rows, columns=["username", "key", "location", "raw", "submitted", "status", "updated"])
+        _entries["raw"] = _entries["raw"].astype(bool)
+        for c in ("submitted", "updated"):
+            _entries[c] = pd.to_datetime(_entries[c], unit="s")
+        return _entries
@@ -0,0 +1,185 @@
+"""
+Local store of price history, used by session.price_history_incremental to only ask DSS for the dates it does not hold yet. The store is a parquet dataset partitioned by instrument when pyarrow is installed, gzipped csv files laid out the same way otherwise.
+"""
+
+import os
+import hashlib
+import pandas as pd
+from datascope import cache
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+one_day = pd.Timedelta(days=1)
+
+
+def _day(value):
+    return pd.Timestamp(value).tz_localize(None).normalize()
+
+
+def gaps(covered, start, end):
+    """
+    Date ranges of [start, end] (inclusive, whole days) not covered by any of the covered [start, end] ranges. Dates are returned as Timestamps.
+    """
+    _gaps = []
+    _next = start
+    for s, e in sorted(covered):
+        if e < _next:
+            continue
+        if s > end:
+            break
+        if s > _next:
+            _gaps.append((_next, s - one_day))
+        _next = max(_next, e + one_day)
+    if _next <= end:
+        _gaps.append((_next, end))
+    return _gaps
+
+
+def merge(covered, start, end):
+    """
+    Adds [start, end] to a list of covered ranges, joining ranges that overlap or touch.
+    """
+    _merged = []
+    for s, e in sorted(covered + [(start, end)]):
+        if _merged and s <= _merged[-1][1] + one_day:
+            _merged[-1] = (_merged[-1][0], max(_merged[-1][1], e))
+        else:
+            _merged.append((s, e))
+    return _merged
+
+
+def merge_all(covered, ranges):
+    """
+    Adds several [start, end] ranges to a list of covered ranges.
+    """
+    for s, e in ranges:
+        covered = merge(covered, s, e)
+    return covered
+
+
+class history_store:
+    """
+    Price history keyed by (instrument, trade date, field), stored as a dataset partitioned by instrument: folder/history/prices/instrument=<sha1 of the key>/data.parquet holds the rows of one instrument, Trade Date and one column per field. Without pyarrow the partitions hold data.csv.gz instead. coverage.json records, per instrument and field, the date ranges already fetched from DSS, so days without prices (weekends, holidays) are not asked for again.
+    """
+
+    date_field = "Trade Date"
+
+    def __init__(self, folder = None):
+        self.folder = os.path.join(folder or cache.default_folder, "history", "prices")
+        self.coverage_path = os.path.join(self.folder, "coverage.json")
+        self.data_file = "data.parquet" if pyarrow is not None else "data.csv.gz"
+
+    def key(self, inst):
+        return inst["IdentifierType"] + "|" + inst["Identifier"]
+
+    def _path(self, key):
+        return os.path.join(self.folder, "instrument=" + hashlib.sha1(key.encode("utf-8")).hexdigest(), self.data_file)
+
+    def _load(self, key):
+        """
+        Stored frame of an instrument, indexed by Trade Date, or None when nothing is stored for it.
+        """
+        _path = self._path(key)
+        if not os.path.exists(_path):
+            return None
+        if pyarrow is not None:
+            _frame = pyarrow.parquet.read_table(_path).to_pandas()
+        else:
+            _frame = pd.read_csv(_path, parse_dates=[self.date_field])
+        return _frame.set_index(self.date_field)
+
+    def _save(self, key, frame):
+        """
+        Replaces the stored frame of an instrument. The file is written next to its final path and moved in place, so readers never see half of it.
+        """
+        _path = self._path(key)
+        _tmp = _path + "." + str(os.getpid()) + ".tmp"
+        os.makedirs(os.path.dirname(_path), exist_ok=True)
+        frame = frame.rename_axis(self.date_field).reset_index()
+        if pyarrow is not None:
+            try:
+                _table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                _mixed = [k for k in frame.columns if frame[k].dtype == object]
+                frame[_mixed] = frame[_mixed].apply(lambda c: c.where(c.isna(), c.astype(str)))
+                _table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            pyarrow.parquet.write_table(_table, _tmp)
+        else:
+            frame.to_csv(_tmp, index=False, compression="gzip")
+        os.replace(_tmp, _path)
+
+    def _coverage(self):
+        _raw = cache.read_json(self.coverage_path, {})
+        return {k: {f: [(pd.Timestamp(s), pd.Timestamp(e)) for s, e in v] for f, v in fields.items()} for k, fields in _raw.items()}
+
+    def plan(self, instruments, fields, start, end):
+        """
+        Works out which dates are missing for each instrument and groups the instruments by missing range. Returns {(gap start, gap end): [instruments]}. A range counts as missing for an instrument when any of the fields has not been fetched for it.
+        """
+        start, end = _day(start), _day(end)
+        _coverage = self._coverage()
+        _plan = {}
+        for inst in instruments:
+            _fields = _coverage.get(self.key(inst), {})
+            _missing = []
+            for f in fields:
+                _missing = merge_all(_missing, gaps(_fields.get(f, []), start, end))
+            for g in _missing:
+                _plan.setdefault(g, []).append(inst)
+        return _plan
+
+    def upsert(self, content, instruments, fields, start, end):
+        """
+        Writes the rows of an extraction into the store, replacing stored values of the same trade date, and marks [start, end] as fetched for instruments and fields. Dates from today on are not marked, as their prices may still change.
+        """
+        start, end = _day(start), min(_day(end), pd.Timestamp.today().normalize() - one_day)
+        _fields = [f for f in fields if f != self.date_field]
+
+        with cache.locked(self.coverage_path):
+            if content is not None and len(content):
+                _content = content.copy()
+                for k in _content.columns:
+                    if isinstance(_content[k].dtype, pd.CategoricalDtype):
+                        _content[k] = _content[k].astype(object)
+                _content[self.date_field] = pd.to_datetime(_content[self.date_field], utc=True).dt.tz_localize(None).dt.normalize()
+                _content["_key"] = _content["IdentifierType"].astype(str) + "|" + _content["Identifier"].astype(str)
+                for k, rows in _content.groupby("_key"):
+                    _new = rows.set_index(self.date_field)[[f for f in _fields if f in rows.columns]]
+                    _new = _new[~_new.index.duplicated(keep="last")]
+                    _stored = self._load(k)
+                    if _stored is not None:
+                        _new = _new.combine_first(_stored)
+                    self._save(k, _new.sort_index())
+
+            if start <= end:
+                _coverage = cache.read_json(self.coverage_path, {})
+                for inst in instruments:
+                    _entry = _coverage.setdefault(self.key(inst), {})
+                    for f in _fields + [self.date_field]:
+                        _ranges = [(pd.Timestamp(s), pd.Timestamp(e)) for s, e in _entry.get(f, [])]
+                        _entry[f] = [(str(s.date()), str(e.date())) for s, e in merge(_ranges, start, end)]
+                cache.write_json(self.coverage_path, _coverage)
+
+    def read(self, instruments, fields, start, end):
+        """
+        Stored history of instruments between start and end (inclusive), one row per instrument and trade date with IdentifierType, Identifier, Trade Date and the fields.
+        """
+        start, end = _day(start), _day(end)
+        _fields = [f for f in fields if f != self.date_field]
+        _frames = []
+        for inst in instruments:
+            _frame = self._load(self.key(inst))
+            if _frame is None:
+                continue
+            _frame = _frame.loc[(_frame.index >= start) & (_frame.index <= end)].reindex(columns=_fields)
+            _frame = _frame.rename_axis(self.date_field).reset_index()
+            _frame.insert(0, "Identifier", inst["Identifier"])
+            _frame.insert(0, "IdentifierType", inst["IdentifierType"])
+            _frames.append(_frame)
+        if not _frames:
+            return pd.DataFrame(columns=["IdentifierType", "Identifier", self.date_field] + _fields)
+        return pd.concat(_frames, ignore_index=True)
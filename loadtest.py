@@ -0,0 +1,109 @@
+"""
+End-to-end load test of session.extract against the local stand-in of datascope.mock_server. For every universe size it loads and validates the instruments, runs a number of price extractions and reports jobs/hour, p50/p99 end-to-end latency and the peak memory allocated by Python (tracemalloc) during the extractions.
+
+    python -m datascope.loadtest --sizes 100 1000 10000 --jobs 20 --job-duration 0.5
+"""
+
+import io
+import time
+import argparse
+import tracemalloc
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+from datascope.session import session
+from datascope.mock_server import mock_server
+
+default_fields = ["Trade Date", "Bid Price", "Ask Price", "Currency Code"]
+
+
+def universe(size):
+    """
+    DataFrame of size made up RICs, in the two columns load_pd expects.
+    """
+    return pd.DataFrame({"type": ["RIC"] * size, "id": ["MCK" + str(i) + ".X" for i in range(size)]})
+
+
+def run(sizes = (100, 1000, 10000), jobs = 10, fields = default_fields, extract_options = None, poll_options = None, quiet = True, **server_options):
+    """
+    Runs the load test and returns one dictionary per universe size with: size, jobs, failed, seconds, jobs_per_hour, p50 and p99 (seconds per extract), rows (per extract) and peak_mb.
+    extract_options: keyword arguments of session.extract, e.g. {'chunk_size': 1000}.
+    poll_options: passed to session.set_poll_options, by default polls start after 0.1 seconds.
+    quiet: hides the messages printed by the session.
+    server_options: passed to mock_server, e.g. latency, job_duration, rows_per_instrument or error_rate.
+    """
+    _report = []
+    with mock_server(**server_options) as server, tempfile.TemporaryDirectory() as _cache:
+        _out = io.StringIO() if quiet else None
+        with contextlib.redirect_stdout(_out) if quiet else contextlib.nullcontext():
+            dss = session("load", "test", base_url=server.url, token_cache=False, pool_size=16, cache_dir=_cache)
+            dss.set_poll_options(**dict({"first_poll": 0.1, "interval": 0.1, "jitter": 0}, **(poll_options or {})))
+
+        for size in sizes:
+            with contextlib.redirect_stdout(_out) if quiet else contextlib.nullcontext():
+                dss.load_pd(universe(size))
+                dss.price("eod", fields)
+
+            _latencies = []
+            _failed = 0
+            _rows = 0
+            tracemalloc.start()
+            _start = time.perf_counter()
+            for i in range(jobs):
+                _t = time.perf_counter()
+                with contextlib.redirect_stdout(_out) if quiet else contextlib.nullcontext():
+                    dss.extract(**(extract_options or {}))
+                _latencies.append(time.perf_counter() - _t)
+                if dss.status_code != 200:
+                    _failed += 1
+                else:
+                    _rows = len(dss.content)
+                dss.content = None
+            _seconds = time.perf_counter() - _start
+            _peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            _report.append({
+                "size": size,
+                "jobs": jobs,
+                "failed": _failed,
+                "seconds": _seconds,
+                "jobs_per_hour": jobs / _seconds * 3600,
+                "p50": float(np.percentile(_latencies, 50)),
+                "p99": float(np.percentile(_latencies, 99)),
+                "rows": _rows,
+                "peak_mb": _peak / 1024 ** 2
+            })
+        dss.close()
+    return _report
+
+
+def print_report(report):
+    print(pd.DataFrame(report).to_string(index=False, float_format=lambda x: "%.3f" % x))
+
+
+def main(args = None):
+    _parser = argparse.ArgumentParser(description="Load test of datascope.session.extract against a local DSS stand-in")
+    _parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="universe sizes to test")
+    _parser.add_argument("--jobs", type=int, default=10, help="extractions per universe size")
+    _parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer of the server")
+    _parser.add_argument("--job-duration", type=float, default=0.5, help="seconds an extraction stays pending")
+    _parser.add_argument("--rows", type=int, default=1, help="rows of content per instrument")
+    _parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with a 500")
+    _parser.add_argument("--chunk-size", type=int, default=None, help="chunk_size passed to extract")
+    _args = _parser.parse_args(args)
+
+    print_report(run(
+        sizes=_args.sizes,
+        jobs=_args.jobs,
+        extract_options={"chunk_size": _args.chunk_size},
+        latency=_args.latency,
+        job_duration=_args.job_duration,
+        rows_per_instrument=_args.rows,
+        error_rate=_args.error_rate
+    ))
+
+
+if __name__ == "__main__":
+    main()
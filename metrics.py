@@ -0,0 +1,206 @@
+"""
+Timings and counters of a session, handed to hooks as plain dictionaries. A hook is any callable taking one event:
+
+    dss.metrics.add_hook(print)
+    dss.metrics.add_hook(datascope.metrics.prometheus_exporter('/var/lib/node_exporter/datascope.prom'))
+
+Phase events, {'event': 'phase', 'phase': 'auth' | 'validation' | 'body' | 'raw_download', 'seconds': ..., 'template': ...}, are sent for authentication, every validation batch, every request body built by a template method and every file downloaded by extract_raw.
+Extraction events, {'event': 'extraction', ...}, are sent once per extraction (or per chunk/window) with its template, key, status_code, total seconds, the seconds spent in each phase (submit, queue_wait, download, parse, frame), the number of polls, bytes_sent, bytes_received and rows.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+default_buckets = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class recorder:
+    """
+    Sends events to the hooks added with add_hook and keeps the last keep events in self.recent. Hooks are called one at a time, whatever thread the event comes from. A hook raising an exception is reported and removed.
+    """
+
+    def __init__(self, keep = 100):
+        self.hooks = []
+        self.recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def emit(self, event):
+        with self._lock:
+            self.recent.append(event)
+            for hook in list(self.hooks):
+                try:
+                    hook(event)
+                except Exception as e:
+                    print('Error in metrics hook', hook, ', removed: ', e)
+                    self.hooks.remove(hook)
+
+    @contextmanager
+    def phase(self, name, **labels):
+        """
+        Times the with block and sends it as a phase event. labels are added to the event, and can still be set on the yielded dictionary inside the block.
+        """
+        _event = dict(labels, event="phase", phase=name)
+        _start = time.perf_counter()
+        try:
+            yield _event
+        finally:
+            _event["seconds"] = time.perf_counter() - _start
+            self.emit(_event)
+
+
+class job:
+    """
+    Adds up the http calls of one extraction (see session._send) into its extraction event.
+    """
+
+    def __init__(self, template = None, key = None):
+        self.template = template
+        self.key = key
+        self.start = time.perf_counter()
+        self.calls = 0
+        self.http = 0.0
+        self.submit = 0.0
+        self.download = 0.0
+        self.parse = 0.0
+        self.frame = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.held = 0.0
+
+    def add(self, call):
+        """
+        call: the metrics of one http call, {'seconds', 'bytes_sent', 'bytes_received', 'parse', 'frame'}. The first call is the submission, the one that brought the result is the download.
+        """
+        if call is None:
+            return
+        if self.calls == 0:
+            self.submit = call["seconds"]
+        self.calls += 1
+        self.http += call["seconds"]
+        self.bytes_sent += call.get("bytes_sent", 0)
+        self.bytes_received += call.get("bytes_received", 0)
+        if "parse" in call:
+            self.download = call["seconds"]
+            self.parse = call["parse"]
+            self.frame = call["frame"]
+
+    def streamed(self, seconds, bytes_received, frame, held):
+        """
+        Records a result read as a stream (see session.extract_iter), where download and parse overlap and are both counted as download. held is the time the batches spent with the caller, left out of the extraction time.
+        """
+        self.http += seconds - frame
+        self.download = seconds - frame
+        self.frame = frame
+        self.bytes_received += bytes_received
+        self.held = held
+
+    def event(self, status_code, rows = None):
+        _seconds = time.perf_counter() - self.start - self.held
+        return {
+            "event": "extraction",
+            "template": self.template,
+            "key": self.key,
+            "status_code": status_code,
+            "seconds": _seconds,
+            "submit": self.submit,
+            "queue_wait": max(_seconds - self.http - self.parse - self.frame, 0),
+            "download": self.download,
+            "parse": self.parse,
+            "frame": self.frame,
+            "polls": max(self.calls - 1, 0),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "rows": rows
+        }
+
+
+def _labels(**labels):
+    return "{" + ",".join(k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"' for k, v in sorted(labels.items())) + "}"
+
+
+class prometheus_exporter:
+    """
+    Hook keeping histograms and counters of the events, written in the Prometheus text format to path, e.g. for the node_exporter textfile collector. The file is replaced atomically after every extraction, and after other events at most every interval seconds.
+    Histograms: datascope_extraction_seconds and datascope_phase_seconds, by template (and phase). Counters: datascope_extractions_total by template and status_code, datascope_polls_total, datascope_rows_total, datascope_bytes_sent_total and datascope_bytes_received_total by template.
+    """
+
+    phases = ("submit", "queue_wait", "download", "parse", "frame")
+
+    def __init__(self, path, buckets = default_buckets, interval = 1.0):
+        self.path = path
+        self.buckets = tuple(sorted(buckets))
+        self.interval = interval
+        self._histograms = {}
+        self._counters = {}
+        self._written = 0.0
+
+    def _observe(self, name, value, **labels):
+        _key = (name, _labels(**labels))
+        if not _key in self._histograms:
+            self._histograms[_key] = [[0] * len(self.buckets), 0, 0.0]
+        _h = self._histograms[_key]
+        for n, b in enumerate(self.buckets):
+            if value <= b:
+                _h[0][n] += 1
+        _h[1] += 1
+        _h[2] += value
+
+    def _count(self, name, value, **labels):
+        _key = (name, _labels(**labels))
+        self._counters[_key] = self._counters.get(_key, 0) + (value or 0)
+
+    def __call__(self, event):
+        _template = event.get("template") or "unknown"
+        if event["event"] == "phase":
+            self._observe("datascope_phase_seconds", event["seconds"], phase=event["phase"], template=_template)
+        elif event["event"] == "extraction":
+            self._observe("datascope_extraction_seconds", event["seconds"], template=_template)
+            for p in self.phases:
+                self._observe("datascope_phase_seconds", event[p], phase=p, template=_template)
+            self._count("datascope_extractions_total", 1, template=_template, status_code=event["status_code"])
+            self._count("datascope_polls_total", event["polls"], template=_template)
+            self._count("datascope_rows_total", event["rows"], template=_template)
+            self._count("datascope_bytes_sent_total", event["bytes_sent"], template=_template)
+            self._count("datascope_bytes_received_total", event["bytes_received"], template=_template)
+
+        if event["event"] == "extraction" or time.monotonic() - self._written >= self.interval:
+            self.write()
+
+    def text(self):
+        _lines = []
+        for name in sorted(set(k[0] for k in self._histograms)):
+            _lines.append("# TYPE " + name + " histogram")
+            for (n, labels), (counts, total, value) in sorted(self._histograms.items()):
+                if n != name:
+                    continue
+                for b, c in zip(self.buckets, counts):
+                    _lines.append(name + "_bucket" + labels[:-1] + ',le="' + str(b) + '"}' + " " + str(c))
+                _lines.append(name + "_bucket" + labels[:-1] + ',le="+Inf"}' + " " + str(total))
+                _lines.append(name + "_sum" + labels + " " + repr(value))
+                _lines.append(name + "_count" + labels + " " + str(total))
+        for name in sorted(set(k[0] for k in self._counters)):
+            _lines.append("# TYPE " + name + " counter")
+            for (n, labels), value in sorted(self._counters.items()):
+                if n == name:
+                    _lines.append(name + labels + " " + str(value))
+        return "\n".join(_lines) + "\n"
+
+    def write(self):
+        _dir = os.path.dirname(self.path)
+        if _dir:
+            os.makedirs(_dir, exist_ok=True)
+        _tmp = self.path + "." + str(os.getpid()) + ".tmp"
+        with open(_tmp, "w") as f:
+            f.write(self.text())
+        os.replace(_tmp, self.path)
+        self._written = time.monotonic()
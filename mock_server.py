@@ -0,0 +1,326 @@
+"""
+Local stand-in for the DSS REST API, answering the calls session makes with generated data. It lets the library be exercised, measured and regression tested without live credentials:
+
+    with mock_server(job_duration=1) as server:
+        dss = datascope.session('id', 'pw', base_url=server.url, token_cache=False)
+
+Only the Python standard library is used.
+"""
+
+import re
+import gzip
+import json
+import time
+import random
+import threading
+import itertools
+from urllib.parse import unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+fields = {
+    "Trade Date": "Date",
+    "Bid Price": "Number",
+    "Ask Price": "Number",
+    "Universal Close Price": "Number",
+    "High Price": "Number",
+    "Low Price": "Number",
+    "Volume": "Number",
+    "Currency Code": "Text",
+    "Exchange Code": "Text",
+    "Asset Type": "Text",
+    "Security Description": "Text",
+    "Ex-Date": "Date",
+    "Dividend Rate": "Number",
+    "Corporate Action Type": "Text"
+}
+
+corax_event_types = {
+    "IncludeCapitalChangeEvents": "Capital Change",
+    "IncludeDividendEvents": "Dividend",
+    "IncludeEarningsEvents": "Earnings",
+    "IncludeMergersAndAcquisitionsEvents": "Mergers and Acquisitions",
+    "IncludeNominalValueEvents": "Nominal Value",
+    "IncludePublicEquityOfferingsEvents": "Public Equity Offerings",
+    "IncludeSharesOutstandingEvents": "Shares Outstanding",
+    "IncludeVotingRightsEvents": "Voting Rights"
+}
+
+bond_schedule_types = ["Call", "Put", "Sink", "Coupon", "Factor"]
+
+
+class mock_server:
+    """
+    Runs the stand-in on 127.0.0.1 in a background thread. Use server.url as the base_url of a session.
+    port: 0 picks a free port.
+    latency: seconds added to every answer.
+    job_duration: seconds an extraction stays pending (202) after its submission. 0 answers it straight away.
+    rows_per_instrument: rows of content generated for every instrument of an extraction, which sets the payload size.
+    error_rate: fraction of validation and extraction calls answered with a 500.
+    retry_after: when set, sent as the Retry-After header of every 202.
+    invalid_rate: fraction of instruments reported as not valid by InstrumentListValidateIdentifiers.
+    """
+
+    def __init__(self, port = 0, latency = 0.0, job_duration = 2.0, rows_per_instrument = 1, error_rate = 0.0, retry_after = None, invalid_rate = 0.0):
+        self.latency = latency
+        self.job_duration = job_duration
+        self.rows_per_instrument = rows_per_instrument
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.invalid_rate = invalid_rate
+        self.token = "mock-token"
+        self.jobs = {}
+        self.lists = {}
+        self.calls = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.httpd.server_address[1]) + "/RestApi/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _submit(self, body, raw):
+        _id = "0x" + format(next(self._ids), "016x")
+        with self._lock:
+            self.jobs[_id] = {"body": body, "due": time.monotonic() + self.job_duration, "raw": raw}
+        return _id
+
+    def _value(self, field, n):
+        _type = fields.get(field, "Number")
+        if _type == "Date":
+            return "2020-01-%02dT00:00:00.000Z" % (n % 28 + 1)
+        if _type == "Text":
+            return field[:3].upper() + str(n % 7)
+        return round(100 + random.random() * 10, 4)
+
+    def instruments(self, body):
+        """
+        Instruments of an extraction, inline or from the instrument list it refers to.
+        """
+        _identifiers = body["ExtractionRequest"]["IdentifierList"]
+        if "InstrumentListId" in _identifiers:
+            return list(self.lists[_identifiers["InstrumentListId"]]["items"].values())
+        return _identifiers["InstrumentIdentifiers"]
+
+    def contents(self, body):
+        """
+        Rows of an extraction: rows_per_instrument rows per instrument with a generated value for every field asked. Corporate Action Type cycles through the event types turned on in the Condition.
+        """
+        _request = body["ExtractionRequest"]
+        _fields = _request.get("ContentFieldNames", [])
+        _condition = _request.get("Condition") or {}
+        _events = [v for k, v in corax_event_types.items() if _condition.get(k) == "true"] or ["Dividend"]
+        _rows = []
+        for inst in self.instruments(body):
+            for n in range(self.rows_per_instrument):
+                _row = {"IdentifierType": inst["IdentifierType"], "Identifier": inst["Identifier"]}
+                for f in _fields:
+                    _row[f] = _events[n % len(_events)] if f == "Corporate Action Type" else self._value(f, n)
+                _rows.append(_row)
+        return _rows
+
+    def notes(self, body):
+        _count = len(self.instruments(body))
+        return ["Extraction Services Version mock\r\nProcessing completed successfully, " + str(_count) + " instruments", ""]
+
+
+class _handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def _send(self, status, body = None, headers = None, raw = None):
+        if raw is None:
+            raw = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(raw)))
+        if raw and body is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _body(self):
+        _length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(_length) or b"{}")
+
+    def _path(self):
+        _path = unquote(self.path.split("?")[0])
+        if not _path.startswith("/RestApi/v1/"):
+            return None
+        return _path[len("/RestApi/v1/"):]
+
+    def _authorized(self):
+        if self.headers.get("Authorization") == "Token " + self.mock.token:
+            return True
+        self._send(401, {"error": {"message": "Authorization failed"}})
+        return False
+
+    def _failed(self):
+        if self.mock.error_rate and random.random() < self.mock.error_rate:
+            self._send(500, {"error": {"message": "mock server error"}})
+            return True
+        return False
+
+    def do_POST(self):
+        _path = self._path()
+        _body = self._body()
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        self.mock._count(_path)
+
+        if _path == "Authentication/RequestToken":
+            self._send(200, {"value": self.mock.token})
+            return
+        if not self._authorized() or self._failed():
+            return
+        _list_action = re.match(r"Extractions/InstrumentLists\('(\w+)'\)/ThomsonReuters\.Dss\.Api\.Extractions\.InstrumentList(Append|Remove)Identifiers$", _path or "")
+
+        if _path == "Extractions/InstrumentListValidateIdentifiers":
+            _rows = []
+            for i in _body["InputsForValidation"]:
+                _valid = not (self.mock.invalid_rate and random.random() < self.mock.invalid_rate)
+                _rows.append(dict(i, Status="Valid" if _valid else "Invalid", Source=i.get("Source") or "MCK"))
+            _valid = sum(r["Status"] == "Valid" for r in _rows)
+            self._send(200, {"ValidatedInstruments": _rows, "ValidationResult": {"ValidInstrumentCount": _valid, "Messages": []}})
+        elif _path == "Extractions/InstrumentLists":
+            _id = "0x" + format(next(self.mock._ids), "016x")
+            with self.mock._lock:
+                self.mock.lists[_id] = {"name": _body["Name"], "items": {}}
+            self._send(201, {"ListId": _id, "Name": _body["Name"]})
+        elif _list_action:
+            _list = self.mock.lists.get(_list_action.group(1))
+            if _list is None:
+                self._send(404, {"error": {"message": "unknown list"}})
+                return
+            _keys = [(i["IdentifierType"], i["Identifier"], i.get("Source") or "") for i in _body["Identifiers"]]
+            with self.mock._lock:
+                if _list_action.group(2) == "Append":
+                    _new = [(k, i) for k, i in zip(_keys, _body["Identifiers"]) if not k in _list["items"]]
+                    _list["items"].update(_new)
+                else:
+                    for k in _keys:
+                        _list["items"].pop(k, None)
+            if _list_action.group(2) == "Append":
+                self._send(200, {"AppendResult": {"ValidInstrumentCount": len(_new), "AppendedInstrumentCount": len(_new)}})
+            else:
+                self._send(204)
+        elif _path in ("Extractions/ExtractWithNotes", "Extractions/ExtractRaw"):
+            _id = self.mock._submit(_body, _path.endswith("Raw"))
+            if self.mock.job_duration > 0:
+                self._pending(_id)
+            else:
+                self._result(_id)
+        else:
+            self._send(404, {"error": {"message": "unknown path " + str(_path)}})
+
+    def do_GET(self):
+        _path = self._path()
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        self.mock._count(_path)
+        if not self._authorized():
+            return
+
+        _job = re.match(r"Extractions/ExtractWithNotesResult\(ExtractionId='(\w+)'\)$", _path or "")
+        _raw = re.match(r"Extractions/RawExtractionResults\('(\w+)'\)/\$value$", _path or "")
+        _template = re.match(r"Extractions/(GetValidExtractionFieldNames|GetValidContentFieldTypes)\(", _path or "")
+        _list = re.match(r"Extractions/InstrumentListGetByName\(ListName='(.*)'\)$", _path or "")
+        _list_items = re.match(r"Extractions/InstrumentLists\('(\w+)'\)/ThomsonReuters\.Dss\.Api\.Extractions\.InstrumentListGetAllInstruments$", _path or "")
+        if _job:
+            if self._failed():
+                return
+            _id = _job.group(1)
+            if not _id in self.mock.jobs:
+                self._send(404, {"error": {"message": "unknown job " + _id}})
+            elif time.monotonic() < self.mock.jobs[_id]["due"]:
+                self._pending(_id)
+            else:
+                self._result(_id)
+        elif _raw:
+            _job = self.mock.jobs.get(_raw.group(1))
+            if _job is None:
+                self._send(404, {"error": {"message": "unknown job"}})
+                return
+            _rows = self.mock.contents(_job["body"])
+            _columns = ["IdentifierType", "Identifier"] + list(_job["body"]["ExtractionRequest"].get("ContentFieldNames", []))
+            _lines = [",".join(_columns)] + [",".join(str(r[c]) for c in _columns) for r in _rows]
+            self._send(200, raw=gzip.compress(("\n".join(_lines) + "\n").encode("utf-8")), headers={"Content-Encoding": "gzip", "Content-Type": "text/plain"})
+        elif _list:
+            _ids = [k for k, v in self.mock.lists.items() if v["name"] == _list.group(1)]
+            if _ids:
+                self._send(200, {"ListId": _ids[0], "Name": _list.group(1)})
+            else:
+                self._send(404, {"error": {"message": "list not found"}})
+        elif _list_items:
+            _list = self.mock.lists.get(_list_items.group(1))
+            if _list is None:
+                self._send(404, {"error": {"message": "unknown list"}})
+            else:
+                self._send(200, {"value": list(_list["items"].values())})
+        elif _template and _template.group(1) == "GetValidExtractionFieldNames":
+            self._send(200, {"value": list(fields)})
+        elif _template:
+            self._send(200, {"value": [{"Name": k, "FormatType": v} for k, v in fields.items()]})
+        elif _path == "Users/UserClaims":
+            self._send(200, {"value": [{"ClaimName": "mock", "ClaimValue": "true"}]})
+        elif _path and _path.startswith("Users/Users(") and _path.endswith(")/Preferences"):
+            self._send(200, {"@odata.context": "mock", "value": {"UserId": 1, "UserName": "mock", "Email": "mock@localhost", "Phone": ""}})
+        elif _path == "Extractions/BondScheduleReportTemplateGetBondScheduleTypes":
+            self._send(200, {"value": [{"Code": i, "Name": i} for i in bond_schedule_types]})
+        else:
+            self._send(404, {"error": {"message": "unknown path " + str(_path)}})
+
+    def do_DELETE(self):
+        _path = self._path()
+        self.mock._count(_path)
+        if not self._authorized():
+            return
+        _list = re.match(r"Extractions/InstrumentLists\('(\w+)'\)$", _path or "")
+        if _list and self.mock.lists.pop(_list.group(1), None) is not None:
+            self._send(204)
+        else:
+            self._send(404, {"error": {"message": "unknown path " + str(_path)}})
+
+    def _pending(self, job_id):
+        _headers = {"Location": self.mock.url + "/Extractions/ExtractWithNotesResult(ExtractionId='" + job_id + "')"}
+        if self.mock.retry_after is not None:
+            _headers["Retry-After"] = str(self.mock.retry_after)
+        self._send(202, headers=_headers)
+
+    def _result(self, job_id):
+        _job = self.mock.jobs[job_id]
+        if _job["raw"]:
+            self._send(200, {"JobId": job_id, "Notes": self.mock.notes(_job["body"])})
+            return
+        _job = self.mock.jobs.pop(job_id)
+        self._send(200, {"Contents": self.mock.contents(_job["body"]), "Notes": self.mock.notes(_job["body"])})
@@ -0,0 +1,133 @@
+"""
+Incremental reading of ExtractWithNotes responses, used by session.extract_iter to hand out rows of Contents while the body is still downloading.
+"""
+
+import json
+import codecs
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\n\r"
+
+
+class _buffer:
+    """
+    Text decoded so far from an iterator of byte chunks, with a read position. Consumed text is dropped once it grows past a chunk, so memory stays bounded by the largest row.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.done = False
+
+    def more(self):
+        """
+        Appends the next chunk to the text. Returns False once the chunks are exhausted.
+        """
+        if self.done:
+            return False
+        if self.pos > len(self.text) // 2:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        for _chunk in self.chunks:
+            _text = self.utf8.decode(_chunk)
+            if _text:
+                self.text += _text
+                return True
+        self.text += self.utf8.decode(b"", final=True)
+        self.done = True
+        return False
+
+    def peek(self):
+        """
+        Next character that is not whitespace, or '' at the end of the body.
+        """
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return ""
+
+    def expect(self, chars):
+        _char = self.peek()
+        if not _char or not _char in chars:
+            raise ValueError("malformed extraction response, expected " + repr(chars) + " at " + repr(self.text[self.pos:self.pos + 40]))
+        self.pos += 1
+        return _char
+
+    def value(self):
+        """
+        Decodes the next json value, reading more chunks until it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                _value, _end = _decoder.raw_decode(self.text, self.pos)
+                if _end < len(self.text) or self.done:
+                    self.pos = _end
+                    return _value
+            except json.JSONDecodeError:
+                if self.done:
+                    raise
+            self.more()
+
+    def array(self, batch_rows):
+        """
+        Yields the values of the json array starting at the read position as lists of at most batch_rows values. Complete values are decoded straight from the text as it arrives; a value is only taken once the separator after it has been read, so a value cut by the end of a chunk is decoded again in full.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        _batch = []
+        _decode = _decoder.raw_decode
+        while True:
+            _text = self.text
+            _pos = self.pos
+            try:
+                while True:
+                    while _text[_pos] in _whitespace:
+                        _pos += 1
+                    _value, _pos = _decode(_text, _pos)
+                    while _text[_pos] in _whitespace:
+                        _pos += 1
+                    _char = _text[_pos]
+                    if _char != "," and _char != "]":
+                        raise ValueError("malformed extraction response, expected ',' or ']' at " + repr(_text[_pos:_pos + 40]))
+                    _batch.append(_value)
+                    _pos += 1
+                    self.pos = _pos
+                    if _char == "]":
+                        if _batch:
+                            yield _batch
+                        return
+                    if len(_batch) >= batch_rows:
+                        yield _batch
+                        _batch = []
+            except (IndexError, json.JSONDecodeError):
+                if not self.more():
+                    raise ValueError("extraction response ended inside Contents")
+
+
+def contents_batches(chunks, batch_rows, rest):
+    """
+    Yields the rows of the Contents array of an ExtractWithNotes response as lists of at most batch_rows dictionaries, while the body is being read.
+    chunks: iterator of bytes, e.g. response.iter_content().
+    rest: dictionary that receives the other top level entries of the response, such as Notes, once they have been read.
+    """
+    _buf = _buffer(chunks)
+    _buf.expect("{")
+    if _buf.peek() == "}":
+        return
+    while True:
+        _key = _buf.value()
+        _buf.expect(":")
+        if _key != "Contents":
+            rest[_key] = _buf.value()
+        else:
+            yield from _buf.array(batch_rows)
+        if _buf.expect(",}") == "}":
+            return
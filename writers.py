@@ -0,0 +1,234 @@
+"""
+Writers used by session.write_files. Every writer takes the content chunk by chunk, so a result can be written while it is extracted (see session.extract_iter) without holding all of it in memory. Parquet and Feather need pyarrow.
+"""
+
+import os
+import gzip
+import json
+from urllib.parse import quote
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+_date_partitions = {"D": ("day", "%Y-%m-%d"), "M": ("month", "%Y-%m"), "Y": ("year", "%Y")}
+_float_formats = ("Number", "Integer", "Price", "Decimal")
+
+
+def _folder(path):
+    _dir = os.path.dirname(path)
+    if _dir:
+        os.makedirs(_dir, exist_ok=True)
+
+
+class csv_writer:
+    """
+    csv with a header row, gzipped when compression is 'gzip'. types is accepted like the other writers but not used, csv has no schema.
+    """
+
+    extension = ".csv"
+
+    def __init__(self, path, compression = None, types = None, **options):
+        self.path = path
+        self.compression = compression
+        self.options = options
+        self._file = None
+
+    def write(self, frame):
+        _header = self._file is None
+        if _header:
+            _folder(self.path)
+            if self.compression == "gzip":
+                self._file = gzip.open(self.path, "wt", newline="")
+            else:
+                self._file = open(self.path, "w", newline="")
+        frame.to_csv(self._file, header=_header, index=False, **self.options)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _arrow_type(format):
+    """
+    Arrow type of a DSS field format type: float64 for numbers, timestamps for dates (DateTime in UTC) and strings for everything else.
+    """
+    if format in _float_formats:
+        return pyarrow.float64()
+    if format == "Date":
+        return pyarrow.timestamp("ns")
+    if format == "DateTime":
+        return pyarrow.timestamp("ns", tz="UTC")
+    return pyarrow.string()
+
+
+def _plain(values):
+    """
+    Values of a column without categories, so the Arrow type does not depend on the categories seen in a chunk.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(values.cat.categories.dtype)
+    return values
+
+
+class _arrow_writer:
+    """
+    Shared part of the pyarrow writers. All chunks end up in one file, so they are all written with the schema of the first one: fields of the report template get the Arrow type of their format type (see types), other columns the type pandas gives them, strings when they are all null or held as large strings. Every chunk is then conformed to that schema: categories are written as their values, missing columns as nulls, columns not in the schema are left out, and values are converted to the type of their field.
+    types: {field: format type} of the report template, see session.get_field_types.
+    """
+
+    def __init__(self, path, compression = None, types = None, **options):
+        self.path = path
+        self.compression = compression
+        self.types = types or {}
+        self.options = options
+        self.schema = None
+        self._writer = None
+
+    def _schema(self, frame):
+        _fields = []
+        for k in frame.columns:
+            if k in self.types:
+                _type = _arrow_type(self.types[k])
+            else:
+                _type = pyarrow.Array.from_pandas(_plain(frame[k])).type
+                if pyarrow.types.is_null(_type) or pyarrow.types.is_large_string(_type):
+                    _type = pyarrow.string()
+            _fields.append(pyarrow.field(str(k), _type))
+        return pyarrow.schema(_fields)
+
+    def _conform(self, frame):
+        _columns = {}
+        for f in self.schema:
+            if not f.name in frame.columns:
+                _columns[f.name] = pyarrow.nulls(len(frame), f.type)
+                continue
+            _values = _plain(frame[f.name])
+            if pyarrow.types.is_timestamp(f.type) and _values.dtype.kind != "M":
+                _values = pd.to_datetime(_values, errors="coerce", utc=f.type.tz is not None)
+            elif pyarrow.types.is_floating(f.type) and _values.dtype.kind not in "fiu":
+                _values = pd.to_numeric(_values, errors="coerce")
+            elif pyarrow.types.is_string(f.type) and _values.dtype.kind != "O":
+                _values = _values.astype(object).where(_values.notna(), None)
+            _columns[f.name] = pyarrow.Array.from_pandas(_values, type=f.type)
+        return pyarrow.Table.from_pydict(_columns, schema=self.schema)
+
+    def write(self, frame):
+        if self.schema is None:
+            self.schema = self._schema(frame)
+        _table = self._conform(frame)
+        if self._writer is None:
+            _folder(self.path)
+            self._writer = self._open(self.schema)
+        self._writer.write_table(_table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class parquet_writer(_arrow_writer):
+    """
+    Parquet file written one row group per chunk. compression is any parquet codec ('snappy' by default, 'zstd', 'gzip', 'brotli', 'lz4' or 'none'), options are passed to pyarrow.parquet.ParquetWriter.
+    """
+
+    extension = ".parquet"
+
+    def _open(self, schema):
+        return pyarrow.parquet.ParquetWriter(self.path, schema, compression=self.compression or "snappy", **self.options)
+
+
+class feather_writer(_arrow_writer):
+    """
+    Feather v2 (Arrow IPC) file written one record batch per chunk. compression is 'lz4', 'zstd' or None. The file can be memory mapped when read back uncompressed.
+    """
+
+    extension = ".feather"
+
+    def _open(self, schema):
+        return pyarrow.ipc.new_file(self.path, schema, options=pyarrow.ipc.IpcWriteOptions(compression=self.compression, **self.options))
+
+
+writers = {"csv": csv_writer, "parquet": parquet_writer, "feather": feather_writer}
+
+
+def format_of(filename):
+    """
+    Writer format matching the extension of filename, csv when the extension is not known.
+    """
+    _name = filename.lower()
+    if _name.endswith((".parquet", ".pq")):
+        return "parquet"
+    if _name.endswith((".feather", ".arrow", ".ipc")):
+        return "feather"
+    return "csv"
+
+
+class partitioned_writer:
+    """
+    Writes chunks into a hive style folder, one file per value of a column: folder/column=value/part-0.ext, the column itself being left out of the files as its value is in the path. Values are escaped the way hive does it, e.g. / as %2F. Date columns are partitioned by day, month or year following freq ('D', 'M' or 'Y') into folder/day=2020-01-31/, folder/month=2020-01/ or folder/year=2020/ and are kept in the files with their type.
+    At most max_open partition files are kept open. When a new partition comes and the limit is reached, the file used the longest time ago is closed, and a partition that gets rows again after its file was closed goes on in a new part-1.ext, part-2.ext...
+    """
+
+    def __init__(self, folder, format, column, freq = "D", compression = None, max_open = 64, **options):
+        self.folder = folder
+        self.writer = writers[format]
+        self.column = column
+        self.freq = freq
+        self.compression = compression
+        self.max_open = max_open
+        self.options = options
+        self._writers = {}
+        self._parts = {}
+        self._closed = []
+
+    def write(self, frame):
+        _values = frame[self.column]
+        if _values.dtype.kind == "M":
+            _name, _format = _date_partitions[self.freq]
+            _keys = _values.dt.strftime(_format).fillna("null")
+        else:
+            _name = self.column
+            _keys = _values.astype(str)
+            frame = frame.drop(columns=self.column)
+
+        for k, part in frame.groupby(_keys, sort=False):
+            _writer = self._writers.pop(k, None)
+            if _writer is None:
+                if len(self._writers) >= self.max_open:
+                    self._close(next(iter(self._writers)))
+                _part = self._parts.get(k, -1) + 1
+                self._parts[k] = _part
+                _path = os.path.join(self.folder, _name + "=" + quote(k, safe=" -_.,+@"), "part-" + str(_part) + self.writer.extension)
+                if self.writer is csv_writer and self.compression == "gzip":
+                    _path += ".gz"
+                _writer = self.writer(_path, self.compression, **self.options)
+            _writer.write(part)
+            self._writers[k] = _writer
+
+    def _close(self, key):
+        _writer = self._writers.pop(key)
+        _writer.close()
+        self._closed.append(_writer.path)
+
+    def close(self):
+        for k in list(self._writers):
+            self._close(k)
+
+    @property
+    def files(self):
+        return sorted(self._closed + [i.path for i in self._writers.values()])
+
+
+def write_notes(path, notes, ricmaintenance, **info):
+    """
+    Writes the notes and ric maintenance of an extraction as json next to its data: {"notes": [lines], "ricmaintenance": [lines], ...info}.
+    """
+    _folder(path)
+    _split = lambda text: [i for i in (text or "").split("\r\n") if i]
+    with open(path, "w") as f:
+        json.dump(dict(info, notes=_split(notes), ricmaintenance=_split(ricmaintenance)), f, indent=1)